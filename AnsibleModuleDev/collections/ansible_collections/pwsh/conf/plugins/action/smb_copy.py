@@ -1,18 +1,144 @@
 from __future__ import annotations
 
+import collections
+import concurrent.futures
 import hashlib
+import mmap
+import os
 import pathlib
 import typing as t
 
 from ansible.plugins.action import ActionBase
-from ansible.utils.hashing import checksum
 
-HAS_SMBPROTOCOL = True
-try:
-    import smbclient
-    import smbclient.shutil
-except ImportError:
-    HAS_SMBPROTOCOL = False
+# SMB2 charges 1 credit per 64 KiB of payload.
+_SMB_CREDIT_SIZE = 65536
+_SMB_CHUNK_SIZE = 1024 * 1024
+_SMB_MAX_INFLIGHT = 64
+
+# Ansible forks a new worker process for each host and task so this only
+# lives for a single task, it saves rehashing the same src across loop items
+# on one host. Each path only keeps the digest for its latest mtime and size.
+_LOCAL_HASH_CACHE: dict[str, tuple[int, int, str]] = {}
+
+
+def _hint_sequential(fd: t.BinaryIO) -> None:
+    # The advice values are not flags so each one must be set separately.
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+
+def _hint_done(fd: t.BinaryIO) -> None:
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _map_sequential(fd: t.BinaryIO) -> mmap.mmap:
+    # Page faults on the mapping follow its own advice rather than the
+    # posix_fadvise hint on the file.
+    src_map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        src_map.madvise(mmap.MADV_SEQUENTIAL)
+
+    return src_map
+
+
+def _sha256_file(path: pathlib.Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, mode="rb") as fd:
+        _hint_sequential(fd)
+
+        # Hashing the whole mapping in one update call keeps the loop inside
+        # OpenSSL. mmap cannot map an empty file but the empty digest is fine.
+        if os.fstat(fd.fileno()).st_size:
+            with _map_sequential(fd) as src_map:
+                sha256.update(src_map)
+
+    return sha256.hexdigest()
+
+
+def _local_checksum(path: pathlib.Path, stat: os.stat_result) -> str:
+    key = str(path.absolute())
+    cached = _LOCAL_HASH_CACHE.get(key)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    digest = _sha256_file(path)
+    _LOCAL_HASH_CACHE[key] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def _hash_files(files: dict[pathlib.Path, os.stat_result]) -> dict[pathlib.Path, str]:
+    """Get the SHA-256 checksum of multiple local files.
+
+    hashlib releases the GIL while hashing so each file is hashed on its own
+    thread to spread the work across the available cores. A single file is
+    hashed on the calling thread.
+
+    Args:
+        files: The paths to hash and their stat results.
+
+    Returns:
+        dict[pathlib.Path, str]: The hex digest of each path.
+    """
+    if len(files) == 1:
+        return {path: _local_checksum(path, stat) for path, stat in files.items()}
+
+    max_workers = min(len(files), os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = executor.map(_local_checksum, files.keys(), files.values())
+        return dict(zip(files.keys(), digests))
+
+
+def _smb_upload(src: mmap.mmap, dst_fd: t.Any) -> None:
+    """Pipelined SMB upload.
+
+    Keeps multiple write requests in flight on the SMB connection rather than
+    waiting for each response before sending the next chunk. Each request asks
+    for an extra credit so the window grows while data is being sent.
+
+    Args:
+        src: The memory mapped local file to upload.
+        dst_fd: The unbuffered smbclient file object to write to.
+    """
+    smb_open = dst_fd.fd
+    connection = smb_open.connection
+    session_id = smb_open.tree_connect.session.session_id
+    tree_id = smb_open.tree_connect.tree_connect_id
+    chunk_size = min(connection.max_write_size, _SMB_CHUNK_SIZE)
+
+    in_flight: collections.deque[tuple[t.Any, t.Callable[[t.Any], int], int]] = collections.deque()
+
+    def wait_oldest() -> None:
+        request, recv_func, expected = in_flight.popleft()
+        written = recv_func(request)
+        if written != expected:
+            raise Exception(f"SMB write returned {written} bytes but expected {expected}")
+
+    offset = 0
+    total = len(src)
+    while offset < total:
+        credits = connection.sequence_window["high"] - connection.sequence_window["low"]
+        if in_flight and (len(in_flight) >= _SMB_MAX_INFLIGHT or credits < 1):
+            wait_oldest()
+            continue
+
+        length = min(chunk_size, max(credits, 1) * _SMB_CREDIT_SIZE, total - offset)
+        credit_charge = (length - 1) // _SMB_CREDIT_SIZE + 1
+        write_msg, recv_func = smb_open.write(src[offset : offset + length], offset=offset, send=False)
+        request = connection.send(
+            write_msg,
+            sid=session_id,
+            tid=tree_id,
+            credit_request=credit_charge + 1,
+        )
+        in_flight.append((request, recv_func, length))
+        offset += length
+
+    while in_flight:
+        wait_oldest()
+
+    smb_open.end_of_file = max(smb_open.end_of_file, offset)
 
 
 class ActionModule(ActionBase):
@@ -29,22 +155,19 @@ class ActionModule(ActionBase):
         result = super(ActionModule, self).run(tmp, task_vars)
         del tmp  # tmp no longer has any effect
 
-        if not HAS_SMBPROTOCOL:
-            result['failed'] = True
-            result['msg'] = "This plugin requires the smbprotocol library to be installed."
-            return result
-
         source = self._task.args.get('src', None)
         dest = self._task.args.get('dest', None)
 
         if not source or not dest:
             result['failed'] = True
             result['msg'] = "The src and dest options must be set"
+            return result
 
         source_path = pathlib.Path(source)
         if not source_path.exists() or source_path.is_dir():
             result['failed'] = True
             result['msg'] = "The src file does not exist"
+            return result
 
         stat_res = self._execute_module(
             module_name="ansible.windows.win_stat",
@@ -62,12 +185,26 @@ class ActionModule(ActionBase):
             result['msg'] = f"Failed to get stat of remote file: {stat_res.get('msg', 'Unknown failure')}"
             return result
 
-        if stat_res["stat"].get("exists", True):
-            local_checksum = checksum(str(source_path.absolute()), hashlib.sha256)
+        # Only hash the local file when there is a remote checksum to compare
+        # against. A size mismatch means the file has changed so don't bother
+        # hashing in that case either.
+        remote_stat = stat_res["stat"]
+        remote_checksum = remote_stat.get("checksum", "") if remote_stat.get("exists", False) else ""
+        source_stat = source_path.stat()
+        if remote_checksum and remote_stat.get("size") == source_stat.st_size:
+            local_checksum = _hash_files({source_path: source_stat})[source_path]
 
-            if local_checksum.lower() == stat_res["stat"].get("checksum", "").lower():
+            if local_checksum.lower() == remote_checksum.lower():
                 return result
 
+        # smbclient is slow to import, only pay for it when a copy is needed.
+        try:
+            import smbclient
+        except ImportError:
+            result['failed'] = True
+            result['msg'] = "This plugin requires the smbprotocol library to be installed."
+            return result
+
         result['changed'] = True
 
         remote_addr = self._connection.get_option('remote_addr')
@@ -75,9 +212,15 @@ class ActionModule(ActionBase):
         remote_pass = self._connection.get_option('remote_password')
 
         unc_path = f"\\\\{remote_addr}\\c$\\Windows\\Temp\\pwsh.conf.smb_copy"
-        with smbclient.open_file(unc_path, username=remote_user, password=remote_pass, mode="wb") as dst_fd:
-            with open(source_path, mode="rb") as src_fd:
-                smbclient.shutil.copyfileobj(src_fd, dst_fd)
+        with smbclient.open_file(unc_path, username=remote_user, password=remote_pass, mode="wb", buffering=0) as dst_fd:
+            # mmap cannot map an empty file, there is nothing to write anyway.
+            if source_stat.st_size:
+                with open(source_path, mode="rb") as src_fd:
+                    _hint_sequential(src_fd)
+                    with _map_sequential(src_fd) as src_map:
+                        _smb_upload(src_map, dst_fd)
+
+                    _hint_done(src_fd)
 
         try:
             copy_res = self._execute_module(
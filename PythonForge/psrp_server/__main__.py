@@ -11,7 +11,6 @@ import logging
 import os
 import pathlib
 import sys
-import typing
 
 from ._server import OutOfProcTransport, PipeConnection, StdioConnection, get_pipe_name
 
@@ -31,12 +30,7 @@ def configure_file_logging(
     level: str,
     format: str | None = None,
 ) -> None:
-    log_level = {
-        "info": logging.INFO,
-        "debug": logging.DEBUG,
-        "warning": logging.WARNING,
-        "error": logging.ERROR,
-    }[level]
+    log_level = logging.getLevelName(level.upper())
 
     fh = logging.FileHandler(file, mode="a", encoding="utf-8")
     fh.setLevel(log_level)
@@ -47,6 +41,10 @@ def configure_file_logging(
     ansibug_logger.addHandler(fh)
 
 
+def _resolve_log_path(value: str) -> pathlib.Path:
+    return pathlib.Path(os.path.expandvars(value)).expanduser().resolve()
+
+
 def parse_args() -> argparse.Namespace:
     """Parse and return args."""
     parser = argparse.ArgumentParser(description="Starts a Python PSRP Server.")
@@ -68,7 +66,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--log-file",
         action="store",
-        type=lambda v: pathlib.Path(os.path.expanduser(os.path.expandvars(v))),
+        type=_resolve_log_path,
         help="Enable file logging to the file at this path.",
     )
 
@@ -91,10 +89,7 @@ def main(args: list[str]) -> None:
     args = parse_args()
 
     if args.log_file:
-        configure_file_logging(
-            str(typing.cast(pathlib.Path, args.log_file).absolute()),
-            args.log_level,
-        )
+        configure_file_logging(str(args.log_file), args.log_level)
 
     conn: StdioConnection | PipeConnection
     if args.pipe:
@@ -3,33 +3,99 @@
 
 from __future__ import annotations
 
-import base64
+import binascii
+import collections
 import collections.abc
 import dataclasses
 import datetime
+import functools
+import io
 import logging
 import os
 import queue
+import re
 import socket
-import struct
 import sys
 import textwrap
 import threading
 import traceback
+import types
 import typing
 import uuid
-from xml.etree import ElementTree
 
 import psrpcore
 
+HAS_LXML = True
+try:
+    from lxml import etree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree  # type: ignore[no-redef]
+
+    HAS_LXML = False
+
 HAS_PSUTIL = True
 try:
     import psutil
 except ImportError:
     HAS_PSUTIL = False
 
+try:
+    from pybase64 import b64decode, b64encode
+except ImportError:
+    from base64 import b64decode  # type: ignore[assignment]
+
+    # base64.b64encode is a Python wrapper around this call.
+    b64encode = functools.partial(binascii.b2a_base64, newline=False)
+
+# The packets come from the peer process, don't expand entities or reach out
+# to the network when parsing them with lxml.
+_XML_PARSER = (
+    ElementTree.XMLParser(resolve_entities=False, no_network=True) if HAS_LXML else None
+)
+
 log = logging.getLogger("psrp_server")
 
+T = typing.TypeVar("T")
+
+# PowerShell always emits the packets in this form, anything else falls back
+# to the XML parser.
+_PACKET_PATTERN = re.compile(
+    rb"<(Close|Command|Data|Signal)(?: Stream='([^']*)')? PSGuid='([0-9a-fA-F-]{36})'"
+    rb"(?:\s*/>|>([^<]*)</\1>)"
+)
+_ZERO_GUID_STR = "00000000-0000-0000-0000-000000000000"
+_ZERO_GUID_BYTES = _ZERO_GUID_STR.encode()
+
+# COR_E_SYSTEM
+_WRITE_ERROR_HRESULT = -2146233087
+
+# Indexed by whether the stream is PromptResponse.
+_STREAM_TYPES = (psrpcore.StreamType.default, psrpcore.StreamType.prompt_response)
+_DATA_PACKET_PREFIXES = (
+    b"<Data Stream='Default' PSGuid='",
+    b"<Data Stream='PromptResponse' PSGuid='",
+)
+
+_GUID_PACKET_PREFIXES = {
+    element: b"<%s PSGuid='" % element.encode()
+    for element in [
+        "Close",
+        "CloseAck",
+        "Command",
+        "CommandAck",
+        "DataAck",
+        "Signal",
+        "SignalAck",
+    ]
+}
+
+# The EPOCH in FileTime format.
+_EPOCH_FT = 116444736000000000
+_SEC_PER_DAY = 86400
+
+# Marks the end of the pipeline input.
+_END_OF_INPUT = object()
+
 
 @psrpcore.types.PSType(
     [
@@ -39,14 +105,18 @@ log = logging.getLogger("psrp_server")
 )
 class WriteErrorException(psrpcore.types.NETException):
     def __init__(self, message: str) -> None:
-        super().__init__(Message=message, HResult=-2146233087)
+        super().__init__(Message=message, HResult=_WRITE_ERROR_HRESULT)
 
 
 class PipeConnection:
+    _SOCKET_BUFFER = 1 << 20
+    _READ_BUFFER = 1 << 16
+
     def __init__(self, name: str) -> None:
         self._name = name
         self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self._conn: socket.socket | None = None
+        self._reader: io.BufferedReader | None = None
 
     def __enter__(self) -> "PipeConnection":
         if os.name != "nt":
@@ -56,32 +126,51 @@ class PipeConnection:
                 pass
 
         self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._set_buffer_size(self._sock)
         self._sock.bind(self._name)
         self._sock.listen(1)
         self._conn = self._sock.accept()[0]
+        self._set_buffer_size(self._conn)
+        self._reader = typing.cast(
+            io.BufferedReader,
+            self._conn.makefile("rb", buffering=self._READ_BUFFER),
+        )
 
         return self
 
     def __exit__(self, *args: typing.Any) -> None:
+        if self._reader:
+            self._reader.close()
+        self._reader = None
         if self._conn:
             self._conn.close()
         self._conn = None
         self._sock.close()
 
-    def read(self, length: int) -> bytes:
-        conn = self._get_conn()
-        return conn.recv(length)
+    def readline(self) -> bytes:
+        return self._get_reader().readline()
 
     def send(self, data: bytes) -> None:
         conn = self._get_conn()
         conn.sendall(data)
 
+    def _set_buffer_size(self, sock: socket.socket) -> None:
+        # Larger buffers let a whole fragment go through in one call rather
+        # than stalling on the small defaults.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._SOCKET_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._SOCKET_BUFFER)
+
     def _get_conn(self) -> socket.socket:
         if not self._conn:
             raise Exception("Connection has not been opened")
 
         return self._conn
 
+    def _get_reader(self) -> io.BufferedReader:
+        # The reader is created alongside the connection.
+        self._get_conn()
+        return typing.cast(io.BufferedReader, self._reader)
+
 
 class StdioConnection:
     def __enter__(self) -> "StdioConnection":
@@ -90,7 +179,7 @@ class StdioConnection:
     def __exit__(self, *args: typing.Any) -> None:
         pass
 
-    def read(self, length: int) -> bytes:
+    def readline(self) -> bytes:
         return sys.stdin.buffer.readline()
 
     def send(self, data: bytes) -> None:
@@ -99,8 +188,6 @@ class StdioConnection:
 
 
 class OutOfProcTransport:
-    _BUFFER = 32768
-
     def __init__(
         self,
         conn: PipeConnection | StdioConnection,
@@ -117,24 +204,17 @@ class OutOfProcTransport:
         log.info(f"Starting connection for {type(self._conn).__name__}")
         self.runspace.start()
 
-        buffer = []
         with self._conn as conn:
             while True:
-                data = conn.read(self._BUFFER)
-                if not data:
+                # readline returns an unterminated tail at EOF, the peer has
+                # gone so drop the incomplete packet.
+                line = conn.readline()
+                if not line.endswith(b"\n"):
                     log.info("Input pipe has closed")
                     break
 
                 try:
-                    end_idx = data.index(b"\n")
-                except ValueError:
-                    buffer.append(data)
-                    continue
-
-                raw_element = b"".join(buffer) + data[:end_idx]
-                buffer = [data[end_idx + 1 :]]
-                try:
-                    self._process(raw_element)
+                    self._process(line[:-1])
 
                 except Exception as e:
                     log.exception("Unknown exception during message processing")
@@ -171,13 +251,13 @@ class OutOfProcTransport:
 
     def close_ack(
         self,
-        pipeline_id: uuid.UUID | None = None,
+        pipeline_id: uuid.UUID | bytes | None = None,
     ) -> None:
         self._write(ps_guid_packet("CloseAck", pipeline_id))
 
     def command_ack(
         self,
-        pipeline_id: uuid.UUID | None = None,
+        pipeline_id: uuid.UUID | bytes | None = None,
     ) -> None:
         self._write(ps_guid_packet("CommandAck", pipeline_id))
 
@@ -185,17 +265,23 @@ class OutOfProcTransport:
         self,
         data: psrpcore.PSRPPayload,
     ) -> None:
-        self._write(ps_data_packet(*data))
+        guid_bytes = None
+        if data.pipeline_id and (pipeline := self.pipelines.get(data.pipeline_id)):
+            guid_bytes = pipeline.guid_bytes
+
+        self._write(
+            ps_data_packet(data.data, data.stream_type, guid_bytes or data.pipeline_id)
+        )
 
     def data_ack(
         self,
-        pipeline_id: uuid.UUID | None = None,
+        pipeline_id: uuid.UUID | bytes | None = None,
     ) -> None:
         self._write(ps_guid_packet("DataAck", pipeline_id))
 
     def signal_ack(
         self,
-        pipeline_id: uuid.UUID | None = None,
+        pipeline_id: uuid.UUID | bytes | None = None,
     ) -> None:
         self._write(ps_guid_packet("SignalAck", pipeline_id))
 
@@ -206,41 +292,57 @@ class OutOfProcTransport:
 
     def _process(self, data: bytes) -> None:
         log.debug("Processing: %r", data)
-        element = ElementTree.fromstring(data)
-        ps_guid: uuid.UUID | None = uuid.UUID(element.attrib["PSGuid"])
-        if ps_guid == uuid.UUID(int=0):
-            ps_guid = None
 
-        log.info("Processing %s [PID %s]", element.tag, ps_guid or "None")
+        text: str | bytes | None
+        ps_guid: uuid.UUID | None
+        match = _PACKET_PATTERN.fullmatch(data)
+        if match:
+            tag = match.group(1).decode()
+            stream_type = (match.group(2) or b"").decode()
+            raw_guid = match.group(3)
+            ps_guid = (
+                None if raw_guid == _ZERO_GUID_BYTES else uuid.UUID(raw_guid.decode())
+            )
+            text = match.group(4)
 
-        if element.tag == "Close":
+        else:
+            element = ElementTree.fromstring(data, _XML_PARSER)
+            tag = element.tag
+            stream_type = element.attrib.get("Stream", "")
+            guid_str = typing.cast(str, element.attrib["PSGuid"])
+            ps_guid = None if guid_str == _ZERO_GUID_STR else uuid.UUID(guid_str)
+            text = element.text
+
+        log.info("Processing %s [PID %s]", tag, ps_guid or "None")
+
+        if tag == "Close":
             self._process_close(ps_guid)
             if not ps_guid:
                 return
 
-        elif element.tag == "Command":
+        elif tag == "Command":
             self._process_command(ps_guid)
 
-        elif element.tag == "Data":
-            self._process_data(element.text, element.attrib.get("Stream", ""), ps_guid)
+        elif tag == "Data":
+            self._process_data(text, stream_type, ps_guid)
 
-        elif element.tag == "Signal":
+        elif tag == "Signal":
             self._process_signal(ps_guid)
 
     def _process_close(
         self,
         pipeline_id: uuid.UUID | None = None,
     ) -> None:
+        thread: RunspaceThread | PipelineThread
         if pipeline_id:
-            pipeline = self.pipelines.pop(pipeline_id)
-            pipeline.close()
-            pipeline.join()
+            thread = self.pipelines.pop(pipeline_id)
 
         else:
-            self.runspace.close()
-            self.runspace.join()
+            thread = self.runspace
 
-        self.close_ack(pipeline_id)
+        thread.close()
+        thread.join()
+        self.close_ack(thread.guid_bytes)
 
     def _process_command(
         self,
@@ -252,36 +354,44 @@ class OutOfProcTransport:
                 pipeline_id, PipelineThread(pipeline, self.runspace, self)
             )
             t.start()
-            self.command_ack(pipeline_id)
+            self.command_ack(t.guid_bytes)
 
     def _process_data(
         self,
-        data: str | None,
+        data: str | bytes | None,
         stream_type: str,
         pipeline_id: uuid.UUID | None = None,
     ) -> None:
-        psrp_data = base64.b64decode(data) if data else b""
-        st = (
-            psrpcore.StreamType.prompt_response
-            if stream_type == "PromptResponse"
-            else psrpcore.StreamType.default
-        )
+        psrp_data = b""
+        if data:
+            # Small payloads like the handshake messages are commonly repeated,
+            # larger fragments are unlikely to be and would bloat the cache.
+            if len(data) < 512:
+                psrp_data = _b64decode_cached(data)
+            else:
+                psrp_data = b64decode(data)
+        st = _STREAM_TYPES[stream_type == "PromptResponse"]
         self.runspace.runspace.receive_data(
             psrpcore.PSRPPayload(psrp_data, st, pipeline_id)
         )
 
-        while True:
-            event = self.runspace.runspace.next_event()
-            if not event:
-                break
+        thread: RunspaceThread | PipelineThread | None
+        if pipeline_id:
+            # psrpcore accepts an empty payload for an unknown pipeline, only
+            # a packet that produces events needs the pipeline to exist.
+            thread = self.pipelines.get(pipeline_id)
+
+        else:
+            thread = self.runspace
 
-            if pipeline_id:
-                self.pipelines[pipeline_id].event_queue.put(event)
+        events = list(iter(self.runspace.runspace.next_event, None))
+        if events:
+            if thread is None:
+                raise KeyError(pipeline_id)
 
-            else:
-                self.runspace.event_queue.put(event)
+            thread.event_queue.extend(events)
 
-        self.data_ack(pipeline_id)
+        self.data_ack(thread.guid_bytes if thread else pipeline_id)
 
     def _process_signal(
         self,
@@ -290,7 +400,35 @@ class OutOfProcTransport:
         if pipeline_id:
             pipeline = self.pipelines[pipeline_id]
             pipeline.stop()
-            self.signal_ack(pipeline_id)
+            self.signal_ack(pipeline.guid_bytes)
+
+
+class _EventQueue(typing.Generic[T]):
+    """Unbounded queue for a single consumer thread.
+
+    A deque is thread safe for append and popleft so the only synchronisation
+    needed is an Event to wake up the consumer. This avoids the lock and
+    conditions queue.Queue acquires on every put and get.
+    """
+
+    def __init__(self) -> None:
+        self._items: collections.deque[T] = collections.deque()
+        self._ready = threading.Event()
+
+    def put(self, item: T) -> None:
+        self._items.append(item)
+        self._ready.set()
+
+    def extend(self, items: collections.abc.Iterable[T]) -> None:
+        self._items.extend(items)
+        self._ready.set()
+
+    def get(self) -> T:
+        while not self._items:
+            self._ready.wait()
+            self._ready.clear()
+
+        return self._items.popleft()
 
 
 class RunspaceThread(threading.Thread):
@@ -302,7 +440,8 @@ class RunspaceThread(threading.Thread):
         super().__init__(name="runspace")
         self.runspace = runspace
         self.transport = transport
-        self.event_queue: queue.Queue[psrpcore.PSRPEvent | None] = queue.Queue()
+        self.event_queue: _EventQueue[psrpcore.PSRPEvent | None] = _EventQueue()
+        self.guid_bytes = _ZERO_GUID_BYTES
 
         self._host_waiter = threading.Condition()
         self._host_result: dict[int, typing.Any] = {}
@@ -351,11 +490,14 @@ class PipelineThread(threading.Thread):
         self.pipeline = pipeline
         self.runspace_thread = runspace_thread
         self.transport = transport
-        self.event_queue: queue.Queue[psrpcore.PSRPEvent | None] = queue.Queue()
+        self.event_queue: _EventQueue[psrpcore.PSRPEvent | None] = _EventQueue()
+        self.guid_bytes = str(pipeline.pipeline_id).lower().encode()
 
         self._host_waiter = threading.Condition()
         self._host_result: dict[int, typing.Any] = {}
         self._worker: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stop_requested = False
 
     @property
     def runspace(self) -> psrpcore.ServerRunspacePool:
@@ -364,24 +506,11 @@ class PipelineThread(threading.Thread):
     def run(self) -> None:
         log.info("Starting pipeline thread %s", self.pipeline.pipeline_id)
 
-        pipeline_input = []
-        pipeline_complete = True
-        add_condition = threading.Condition()
+        pipeline_input: queue.SimpleQueue[typing.Any] = queue.SimpleQueue()
 
         def pipeline_iter() -> collections.abc.Iterable[typing.Any]:
-            idx = 0
-            while True:
-                with add_condition:
-                    if idx < len(pipeline_input):
-                        value = pipeline_input[idx]
-                        idx += 1
-                        yield value
-
-                    elif pipeline_complete:
-                        break
-
-                    else:
-                        add_condition.wait()
+            while (value := pipeline_input.get()) is not _END_OF_INPUT:
+                yield value
 
         while True:
             event = self.event_queue.get()
@@ -390,9 +519,7 @@ class PipelineThread(threading.Thread):
             )
 
             if not event:
-                pipeline_complete = True
-                with add_condition:
-                    add_condition.notify_all()
+                pipeline_input.put(_END_OF_INPUT)
 
                 with self._host_waiter:
                     self._host_waiter.notify_all()
@@ -400,21 +527,19 @@ class PipelineThread(threading.Thread):
                 break
 
             if isinstance(event, psrpcore.CreatePipelineEvent):
-                pipeline_complete = event.pipeline.no_input
+                if event.pipeline.no_input:
+                    pipeline_input.put(_END_OF_INPUT)
+
                 self.start_pwsh_pipeline(
                     event.pipeline,
                     pipeline_iter(),
                 )
 
             elif isinstance(event, psrpcore.PipelineInputEvent):
-                with add_condition:
-                    pipeline_input.append(event.data)
-                    add_condition.notify_all()
+                pipeline_input.put(event.data)
 
             elif isinstance(event, psrpcore.EndOfPipelineInputEvent):
-                pipeline_complete = True
-                with add_condition:
-                    add_condition.notify_all()
+                pipeline_input.put(_END_OF_INPUT)
 
             elif isinstance(event, psrpcore.PipelineHostResponseEvent):
                 value = event.error if event.error is not None else event.result
@@ -431,11 +556,28 @@ class PipelineThread(threading.Thread):
         info: psrpcore.PowerShell,
         input_data: collections.abc.Iterable[typing.Any],
     ) -> None:
-        script = textwrap.dedent(info.commands[0].command_text)
+        with self._start_lock:
+            self.pipeline.start()
+            _ = self.runspace.data_to_send()
+
+            # A stop signal can arrive before the pipeline has started, the
+            # script is not run at all in that case.
+            if self._stop_requested:
+                self.pipeline.begin_stop()
+                self.pipeline.stop()
+                self._send_data()
+                return
+
+        # Each script gets its own thread as it can block indefinitely on
+        # pipeline input or host calls.
         self._worker = threading.Thread(
             name=f"pipeline-{self.pipeline.pipeline_id!s}-worker",
             target=self._exec,
-            args=(script, info.commands[0].parameters, input_data),
+            args=(
+                info.commands[0].command_text,
+                info.commands[0].parameters,
+                input_data,
+            ),
         )
         self._worker.start()
 
@@ -446,9 +588,6 @@ class PipelineThread(threading.Thread):
         input_data: collections.abc.Iterable[typing.Any],
     ) -> None:
         try:
-            self.pipeline.start()
-            _ = self.runspace.data_to_send()
-
             arguments = []
             parameters = {}
             for raw_name, raw_value in raw_parameters:
@@ -474,7 +613,7 @@ class PipelineThread(threading.Thread):
 
             try:
                 log.debug("Starting Python code\n%s", code)
-                exec(code, exec_globals)
+                exec(_compile_script(code), exec_globals)
                 log.debug("Python code ran successfully")
                 self.pipeline.complete()
             except SyntaxError as e:
@@ -527,8 +666,20 @@ class PipelineThread(threading.Thread):
         self.event_queue.put(None)
 
     def stop(self) -> None:
-        self.pipeline.begin_stop()
-        _ = self.runspace.data_to_send()
+        with self._start_lock:
+            state = self.pipeline.state
+            if state == psrpcore.types.PSInvocationState.NotStarted:
+                self._stop_requested = True
+                return
+
+            elif state not in [
+                psrpcore.types.PSInvocationState.Running,
+                psrpcore.types.PSInvocationState.Stopping,
+            ]:
+                return
+
+            self.pipeline.begin_stop()
+            _ = self.runspace.data_to_send()
 
     def _send_data(self) -> None:
         data = self.runspace.data_to_send()
@@ -593,12 +744,11 @@ class PSCmdlet:
             if cat_target_type is None:
                 cat_target_type = type(target_object).__name__
 
-        cat_info = psrpcore.types.ErrorCategoryInfo(
-            Category=category,
-            Activity="Write-Error",
-            Reason=category_reason,
-            TargetName=cat_target_name,
-            TargetType=cat_target_type,
+        cat_info = _write_error_category_info(
+            category,
+            category_reason,
+            cat_target_name,
+            cat_target_type,
         )
         error_details = None
         if recommended_action:
@@ -720,9 +870,8 @@ def get_pipe_name() -> str:
     ct = datetime.datetime.fromtimestamp(proc.create_time()).astimezone()
     td = ct.astimezone(utc_tz) - datetime.datetime(1970, 1, 1, 0, 0, 0, tzinfo=utc_tz)
 
-    # Number is EPOCH in FileTime format.
-    start_time_ft = 116444736000000000 + (
-        (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) * 10
+    start_time_ft = _EPOCH_FT + (
+        (td.microseconds + (td.seconds + td.days * _SEC_PER_DAY) * 10**6) * 10
     )
 
     if os.name == "nt":
@@ -733,9 +882,7 @@ def get_pipe_name() -> str:
     else:
         # .NET does `.ToString("X8").Substring(1, 8)`. Using X8 will strip any leading 0's from the hex which is
         # replicated here.
-        start_time = (
-            base64.b16encode(struct.pack(">Q", start_time_ft)).decode().lstrip("0")[1:9]
-        )
+        start_time = f"{start_time_ft:X}"[1:9]
         tmpdir = os.environ.get("TMPDIR", "/tmp")
         pipe_name = os.path.join(
             tmpdir, f"CoreFxPipe_PSHost.{start_time}.{pid}.None.{process_name}"
@@ -744,10 +891,41 @@ def get_pipe_name() -> str:
     return pipe_name
 
 
+@functools.lru_cache(maxsize=128)
+def _write_error_category_info(
+    category: psrpcore.types.ErrorCategory,
+    reason: str,
+    target_name: str | None,
+    target_type: str | None,
+) -> psrpcore.types.ErrorCategoryInfo:
+    # Scripts commonly write the same kind of error repeatedly, the info is
+    # only read when the error is serialized so it can be shared.
+    return psrpcore.types.ErrorCategoryInfo(
+        Category=category,
+        Activity="Write-Error",
+        Reason=reason,
+        TargetName=target_name,
+        TargetType=target_type,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _b64decode_cached(data: str | bytes) -> bytes:
+    return b64decode(data)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_script(code: str) -> types.CodeType:
+    # Scripts are commonly run multiple times, bounding the cache stops a long
+    # running server from holding on to every script it has seen. The dedent
+    # is done here so it is also only done once per unique script.
+    return compile(textwrap.dedent(code), "<pspipeline>", "exec")
+
+
 def ps_data_packet(
     data: bytes,
     stream_type: psrpcore.StreamType = psrpcore.StreamType.default,
-    ps_guid: uuid.UUID | None = None,
+    ps_guid: uuid.UUID | bytes | None = None,
 ) -> bytes:
     """Data packet for PSRP fragments.
 
@@ -758,25 +936,27 @@ def ps_data_packet(
         data: The PSRP fragments to encode.
         stream_type: The stream type to target, Default or PromptResponse.
         ps_guid: Set to `None` or a 0'd UUID to target the RunspacePool,
-            otherwise this should be the pipeline UUID.
+            otherwise this should be the pipeline UUID. Can also be the
+            already encoded GUID bytes.
 
     Returns:
         bytes: The encoded data XML packet.
     """
-    ps_guid = ps_guid or uuid.UUID(int=0)
-    stream_name = (
-        b"Default" if stream_type == psrpcore.StreamType.default else b"PromptResponse"
-    )
-    return b"<Data Stream='%s' PSGuid='%s'>%s</Data>\n" % (
-        stream_name,
-        str(ps_guid).lower().encode(),
-        base64.b64encode(data),
+    prefix = _DATA_PACKET_PREFIXES[stream_type is psrpcore.StreamType.prompt_response]
+    return b"".join(
+        (
+            prefix,
+            _ps_guid_bytes(ps_guid),
+            b"'>",
+            b64encode(data),
+            b"</Data>\n",
+        )
     )
 
 
 def ps_guid_packet(
     element: str,
-    ps_guid: uuid.UUID | None = None,
+    ps_guid: uuid.UUID | bytes | None = None,
 ) -> bytes:
     """Common PSGuid packet for PSRP message.
 
@@ -788,10 +968,21 @@ def ps_guid_packet(
         element: The element type, can be DataAck, Command, CommandAck, Close,
             CloseAck, Signal, and SignalAck.
         ps_guid: Set to `None` or a 0'd UUID to target the RunspacePool,
-            otherwise this should be the pipeline UUID.
+            otherwise this should be the pipeline UUID. Can also be the
+            already encoded GUID bytes.
 
     Returns:
         bytes: The encoded PSGuid packet.
     """
-    ps_guid = ps_guid or uuid.UUID(int=0)
-    return b"<%s PSGuid='%s' />\n" % (element.encode(), str(ps_guid).lower().encode())
+    prefix = _GUID_PACKET_PREFIXES.get(element) or b"<%s PSGuid='" % element.encode()
+    return b"".join((prefix, _ps_guid_bytes(ps_guid), b"' />\n"))
+
+
+def _ps_guid_bytes(ps_guid: uuid.UUID | bytes | None) -> bytes:
+    if isinstance(ps_guid, bytes):
+        return ps_guid
+
+    elif not ps_guid:
+        return _ZERO_GUID_BYTES
+
+    return str(ps_guid).lower().encode()